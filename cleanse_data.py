@@ -6,8 +6,141 @@ Exports foodraw.txt to foodraw.xlsx with cleaned data
 - Ingredients and allergens cleaned using EXCEL FORMULAS (lowercase, alphabets and commas only)
 """
 
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Columns A-C: id, name, link
+# Columns D-E: raw data (ingredients_raw, allergens_raw)
+# Columns F-G: cleaned data using Excel formulas (ingredients, allergensraw)
+HEADERS = ["id", "name", "link", "ingredients_raw", "allergens_raw", "ingredients", "allergensraw"]
+COLUMN_LETTERS = "ABCDEFG"
+COLUMN_WIDTHS = [8, 40, 50, 80, 40, 80, 40]
+HEADER_STYLES = [1, 1, 1, 2, 2, 3, 3]  # cellXfs index: 1 blue, 2 orange (raw), 3 green (formula)
+DATA_STYLE = 4  # cellXfs index: thin border, shared by every data cell
+
+# Fixed parts of the xlsx package
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+# Formula cells carry their cached results, so Excel doesn't need a full recalculation on open
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Food Data" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Header style: bold white font, thin border, centered, with a blue/orange/green fill
+_HEADER_XF = (
+    '<xf numFmtId="0" fontId="1" fillId="{fill}" borderId="1" xfId="0" '
+    'applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+)
+_SOLID_FILL = '<fill><patternFill patternType="solid"><fgColor rgb="{rgb}"/><bgColor rgb="{rgb}"/></patternFill></fill>'
+
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    '<fills count="5">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    + _SOLID_FILL.format(rgb="FF4472C4")  # Blue
+    + _SOLID_FILL.format(rgb="FFED7D31")  # Orange
+    + _SOLID_FILL.format(rgb="FF70AD47")  # Green
+    + '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    + _HEADER_XF.format(fill=2)
+    + _HEADER_XF.format(fill=3)
+    + _HEADER_XF.format(fill=4)
+    + '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# Start of sheet1.xml; the <dimension> (used range) goes right after it, as it depends on the row count
+SHEET_OPEN_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+)
+# Frozen header row and fixed column widths (borders are set per cell, not per column)
+SHEET_HEAD_XML = (
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/>'
+    '</sheetView></sheetViews>'
+    '<sheetFormatPr defaultRowHeight="15"/>'
+    '<cols>'
+    + "".join(
+        f'<col min="{col}" max="{col}" width="{width}" customWidth="1"/>'
+        for col, width in enumerate(COLUMN_WIDTHS, 1)
+    )
+    + '</cols>'
+    '<sheetData>'
+)
+SHEET_TAIL_XML = '</sheetData></worksheet>'
+
+# Characters to remove (numbers and common special characters)
+CHARS_TO_REMOVE = [
+    "0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
+    "(", ")", "[", "]", "{", "}",
+    ".", ":", ";", "!", "?",
+    "/", "\\", "-", "_", "*", "#", "@",
+    "%", "&", "+", "=", "<", ">",
+    "'", '"', "`", "~", "^", "|"
+]
+_REMOVE_TABLE = str.maketrans("", "", "".join(CHARS_TO_REMOVE))
+
+# Excel's TRIM only collapses and strips regular spaces, not tabs or other whitespace
+_SPACE_RUNS_RE = re.compile(" +")
+
+# Control characters XML 1.0 does not allow (same set openpyxl refuses to write)
+ILLEGAL_CHARACTERS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
 
 
 def build_cleaning_formula(cell_ref):
@@ -18,21 +151,11 @@ def build_cleaning_formula(cell_ref):
 
     Uses nested SUBSTITUTE functions to remove unwanted characters
     """
-    # Characters to remove (numbers and common special characters)
-    chars_to_remove = [
-        "0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
-        "(", ")", "[", "]", "{", "}",
-        ".", ":", ";", "!", "?",
-        "/", "\\", "-", "_", "*", "#", "@",
-        "%", "&", "+", "=", "<", ">",
-        "'", '"', "`", "~", "^", "|"
-    ]
-
     # Start with LOWER() to convert to lowercase
     formula = f"LOWER({cell_ref})"
 
     # Wrap with nested SUBSTITUTE to remove each unwanted character
-    for char in chars_to_remove:
+    for char in CHARS_TO_REMOVE:
         # Escape double quotes for Excel formula
         if char == '"':
             formula = f'SUBSTITUTE({formula},CHAR(34),"")'
@@ -45,20 +168,31 @@ def build_cleaning_formula(cell_ref):
     return formula
 
 
+def clean_value(text):
+    """
+    Python equivalent of the cleaning formula (LOWER, SUBSTITUTE, TRIM).
+    Used to store each formula's result alongside it in the workbook.
+    """
+    return _SPACE_RUNS_RE.sub(" ", text.lower().translate(_REMOVE_TABLE)).strip(" ")
+
+
+# Every cleaning formula is identical apart from its cell reference, so the XML-escaped
+# formula is built once and split around a placeholder. str.format() can't be used here
+# because the formula itself contains literal "{" and "}" characters.
+_FORMULA_PREFIX, _FORMULA_SUFFIX = escape(build_cleaning_formula("{ref}").lstrip("=")).split("{ref}")
+
+
 def parse_foodraw(filename="foodraw.txt"):
     """Parse the foodraw.txt file"""
     products = []
 
     with open(filename, "r", encoding="utf-8") as f:
         for line in f:
-            line = line.strip()
-            if not line:
-                continue
-
-            # Split by semicolon
+            # Split by semicolon (fields are stripped below, blank lines have too few parts)
             parts = line.split(";")
+            field_count = len(parts)
 
-            if len(parts) >= 5:
+            if field_count >= 5:
                 product = {
                     "id": parts[0].strip(),
                     "name": parts[1].strip(),
@@ -67,7 +201,7 @@ def parse_foodraw(filename="foodraw.txt"):
                     "link": parts[4].strip()
                 }
                 products.append(product)
-            elif len(parts) == 4:
+            elif field_count == 4:
                 # Missing allergens
                 product = {
                     "id": parts[0].strip(),
@@ -81,95 +215,76 @@ def parse_foodraw(filename="foodraw.txt"):
     return products
 
 
-def create_excel(products, filename="foodraw.xlsx"):
-    """Create Excel file with raw data and Excel formulas for cleaning"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Food Data"
-
-    # Define headers
-    # Columns A-C: id, name, link
-    # Columns D-E: raw data (ingredients_raw, allergens_raw)
-    # Columns F-G: cleaned data using Excel formulas (ingredients, allergensraw)
-    headers = ["id", "name", "link", "ingredients_raw", "allergens_raw", "ingredients", "allergensraw"]
-
-    # Style for headers
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    raw_header_fill = PatternFill(start_color="ED7D31", end_color="ED7D31", fill_type="solid")  # Orange for raw
-    formula_header_fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")  # Green for formula
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-
-    # Write headers with different colors
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.alignment = header_alignment
-        cell.border = thin_border
-
-        # Color coding: blue for basic, orange for raw, green for formula-cleaned
-        if col <= 3:
-            cell.fill = header_fill  # Blue
-        elif col <= 5:
-            cell.fill = raw_header_fill  # Orange (raw data)
-        else:
-            cell.fill = formula_header_fill  # Green (formula cleaned)
-
-    # Write data
-    for row_idx, product in enumerate(products, 2):
-        # Column A: id (as-is)
-        ws.cell(row=row_idx, column=1, value=product["id"])
-
-        # Column B: name (as-is)
-        ws.cell(row=row_idx, column=2, value=product["name"])
-
-        # Column C: link (as-is)
-        ws.cell(row=row_idx, column=3, value=product["link"])
-
-        # Column D: ingredients_raw (original raw data)
-        ws.cell(row=row_idx, column=4, value=product["ingredients"])
+def _text_cell(ref, text, style=0):
+    """Build an inline-string cell, leaving empty values as blank cells"""
+    style_attr = f' s="{style}"' if style else ""
+    text = ILLEGAL_CHARACTERS_RE.sub("", text)
+    if not text:
+        return f'<c r="{ref}"{style_attr}/>'
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t>{escape(text)}</t></is></c>'
 
-        # Column E: allergens_raw (original raw data)
-        ws.cell(row=row_idx, column=5, value=product["allergensraw"])
 
-        # Column F: ingredients (EXCEL FORMULA - references D column)
-        ingredients_formula = build_cleaning_formula(f"D{row_idx}")
-        ws.cell(row=row_idx, column=6, value=ingredients_formula)
+def _formula_cell(ref, source_ref, source_text, style=0):
+    """Build a cell holding the cleaning formula applied to source_ref, with its result cached"""
+    style_attr = f' s="{style}"' if style else ""
+    # Cache the result for the source cell as written, i.e. without illegal characters
+    cleaned = clean_value(ILLEGAL_CHARACTERS_RE.sub("", source_text))
+    return (
+        f'<c r="{ref}"{style_attr} t="str"><f>{_FORMULA_PREFIX}{source_ref}{_FORMULA_SUFFIX}</f>'
+        f'<v>{escape(cleaned)}</v></c>'
+    )
 
-        # Column G: allergensraw (EXCEL FORMULA - references E column)
-        allergens_formula = build_cleaning_formula(f"E{row_idx}")
-        ws.cell(row=row_idx, column=7, value=allergens_formula)
 
-        # Apply border to all cells
-        for col in range(1, 8):
-            ws.cell(row=row_idx, column=col).border = thin_border
+def write_xlsx_fast(products, filename="foodraw.xlsx"):
+    """
+    Write the cleansing workbook as raw SpreadsheetML inside a zip file.
 
-    # Set column widths
-    ws.column_dimensions['A'].width = 8   # id
-    ws.column_dimensions['B'].width = 40  # name
-    ws.column_dimensions['C'].width = 50  # link
-    ws.column_dimensions['D'].width = 80  # ingredients_raw
-    ws.column_dimensions['E'].width = 40  # allergens_raw
-    ws.column_dimensions['F'].width = 80  # ingredients (formula)
-    ws.column_dimensions['G'].width = 40  # allergensraw (formula)
+    The package parts are fixed strings; only sheet1.xml depends on the data
+    and it is streamed row by row, so no per-cell objects are ever built.
+    """
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", ROOT_RELS_XML)
+        zf.writestr("xl/workbook.xml", WORKBOOK_XML)
+        zf.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML)
+        zf.writestr("xl/styles.xml", STYLES_XML)
+
+        with io.TextIOWrapper(zf.open("xl/worksheets/sheet1.xml", "w"), encoding="utf-8") as sheet:
+            sheet.write(SHEET_OPEN_XML)
+            sheet.write(f'<dimension ref="A1:{COLUMN_LETTERS[-1]}{len(products) + 1}"/>')
+            sheet.write(SHEET_HEAD_XML)
+
+            # Header row: blue for basic, orange for raw, green for formula-cleaned
+            header_cells = "".join(
+                _text_cell(f"{letter}1", header, style)
+                for letter, header, style in zip(COLUMN_LETTERS, HEADERS, HEADER_STYLES)
+            )
+            sheet.write(f'<row r="1">{header_cells}</row>')
+
+            # Data rows, all bordered through the one shared style
+            for row_idx, product in enumerate(products, 2):
+                sheet.write(
+                    f'<row r="{row_idx}">'
+                    f'{_text_cell(f"A{row_idx}", product["id"], DATA_STYLE)}'
+                    f'{_text_cell(f"B{row_idx}", product["name"], DATA_STYLE)}'
+                    f'{_text_cell(f"C{row_idx}", product["link"], DATA_STYLE)}'
+                    f'{_text_cell(f"D{row_idx}", product["ingredients"], DATA_STYLE)}'
+                    f'{_text_cell(f"E{row_idx}", product["allergensraw"], DATA_STYLE)}'
+                    f'{_formula_cell(f"F{row_idx}", f"D{row_idx}", product["ingredients"], DATA_STYLE)}'
+                    f'{_formula_cell(f"G{row_idx}", f"E{row_idx}", product["allergensraw"], DATA_STYLE)}'
+                    f'</row>'
+                )
+
+            sheet.write(SHEET_TAIL_XML)
 
-    # Freeze top row
-    ws.freeze_panes = 'A2'
 
-    # Save
-    wb.save(filename)
+def create_excel(products, filename="foodraw.xlsx"):
+    """Create Excel file with raw data and Excel formulas for cleaning"""
+    write_xlsx_fast(products, filename)
     print(f"Saved Excel file: {filename}")
     print(f"  - Columns D & E contain RAW data")
     print(f"  - Columns F & G contain EXCEL FORMULAS that clean the data")
 
-    return wb
-
 
 def main():
     print("=" * 60)
@@ -6,17 +6,326 @@ Collects 200 food products from Open Food Facts API
 - 50 without allergens
 """
 
+import argparse
+import orjson
 import requests
 import time
 import random
 import re
+import statistics
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
 
 BASE_URL = "https://world.openfoodfacts.org"
 SEARCH_URL = f"{BASE_URL}/cgi/search.pl"
 
+# Local cache of API responses, so reruns don't hit the API again for a day
+CACHE_NAME = "off_cache"
+CACHE_EXPIRE_SECONDS = 24 * 60 * 60
+
+# One session keeps the HTTPS connection alive across requests (replaced in main)
+SESSION = requests.Session()
+
+# Result pages fetched concurrently, and how many requests each search may run ahead
+# of validation. Under the API's rate limit a prefetched page costs a full request slot
+# and is usually thrown away once a target is met, so each search fetches one page at a time
+MAX_WORKERS = 4
+FETCH_WINDOW = 1
+
+# Set when main is shutting down, so the collection phases stop queueing page requests
+STOP_REQUESTED = threading.Event()
+
+# Already-collected products in a row after which an allergen search stops paging
+DUPLICATE_STREAK_LIMIT = 20
+
+# Longest wait between retries of a failed request, in seconds
+RETRY_MAX_WAIT = 60
+
+# Request timeouts, in seconds. The read timeout follows recent response times of the
+# same kind of search once enough have been seen: twice the P99, doubled per retry, and
+# kept between MIN_READ_TIMEOUT and the search's fixed timeout (which is also used until then)
+CONNECT_TIMEOUT = 3.05
+MIN_READ_TIMEOUT = 2.0
+LATENCIES = defaultdict(partial(deque, maxlen=128))  # Search kind -> recent response times
+LATENCIES_LOCK = threading.Lock()
+
+# Requests actually sent to the API. Open Food Facts allows about 10 search queries
+# per minute; with a burst of 1 the requests are spaced evenly, so no minute exceeds it
+REQUESTS_PER_MINUTE = 10
+REQUEST_BURST = 1
+
 # Countries to include (USA and UK only)
 ALLOWED_COUNTRIES = ["en:united-states", "en:united-kingdom", "en:us", "en:uk"]
 
+# Common special symbols, replaced with a space by clean_text
+SPECIAL_SYMBOLS = ["•", "·", "●", "○", "■", "□", "▪", "▫", "►", "◄", "★", "☆",
+                   "→", "←", "↑", "↓", "«", "»", "™", "®", "©", "°", "±",
+                   "¹", "²", "³", "¼", "½", "¾", "×", "÷", "†", "‡", "§", "¶",
+                   "…", "‹", "›", "€", "£", "¥", "¢", "₹", "฿",
+                   "_", "*"]  # underscore and asterisk
+
+# Emojis and other unicode symbols (code point ranges), removed by clean_text
+EMOJI_RANGES = [
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F1E0, 0x1F1FF),  # flags
+    (0x2702, 0x27B0),    # dingbats
+    (0x24C2, 0x1F251),   # enclosed characters
+    (0x1F900, 0x1F9FF),  # supplemental symbols
+    (0x1FA00, 0x1FA6F),  # chess symbols
+    (0x1FA70, 0x1FAFF),  # symbols extended
+    (0x2600, 0x26FF),    # misc symbols
+    (0x2022, 0x2022),    # bullet point •
+    (0x00B7, 0x00B7),    # middle dot ·
+]
+
+# Semicolons would break the output format, newlines would break lines
+CLEAN_REPLACEMENTS = {";": ",", "\n": " ", "\r": " "}
+CLEAN_REPLACEMENTS.update({symbol: " " for symbol in SPECIAL_SYMBOLS})
+
+
+class CleanTable(dict):
+    """
+    str.translate table for clean_text. The emoji ranges span ~120k code points,
+    so instead of building them all up front each character's mapping is worked
+    out the first time it is seen and then cached.
+    """
+
+    def __missing__(self, codepoint):
+        if any(low <= codepoint <= high for low, high in EMOJI_RANGES):
+            mapping = None  # Remove
+        else:
+            mapping = codepoint  # Keep as-is
+        self[codepoint] = mapping
+        return mapping
+
+
+CLEAN_TABLE = CleanTable({ord(char): replacement for char, replacement in CLEAN_REPLACEMENTS.items()})
+
+# Common non-English patterns; is_english_text rejects text containing 3 or more
+NON_ENGLISH_PATTERNS = [
+    # French
+    "é", "è", "ê", "ë", "à", "â", "ô", "î", "ï", "ù", "û", "ç", "œ", "æ",
+    # German
+    "ä", "ö", "ü", "ß",
+    # Spanish/Portuguese
+    "ñ", "ã", "õ",
+    # Arabic
+    "ال", "من", "في",
+    # Chinese/Japanese/Korean (check for character ranges)
+    # Other indicators
+    "ingrédients", "zucker", "azúcar", "açúcar", "zutaten",
+    "sucre", "farine", "huile", "lait", "beurre", "œufs",
+    "leche", "harina", "aceite", "mantequilla",
+    "milch", "mehl", "öl", "butter", "eier",
+]
+
+# Common English food words; is_english_text needs at least 2 (positive indicator)
+ENGLISH_FOOD_WORDS = [
+    "sugar", "salt", "water", "oil", "flour", "milk", "cream", "butter",
+    "egg", "wheat", "contains", "ingredients", "natural", "flavor",
+    "extract", "powder", "syrup", "acid", "vitamin", "protein",
+    "modified", "starch", "emulsifier", "preservative", "color",
+    "artificial", "organic", "whole", "enriched", "dried"
+]
+
+# Common food words; ingredient lists with none of them are likely garbage data
+FOOD_INDICATORS = [
+    "sugar", "salt", "water", "oil", "flour", "milk", "cream", "butter",
+    "egg", "wheat", "corn", "rice", "starch", "extract", "flavor",
+    "acid", "vitamin", "protein", "fat", "sodium", "calcium",
+    "natural", "organic", "powder", "syrup", "juice", "puree",
+    "vegetable", "fruit", "meat", "fish", "chicken", "beef",
+    "tomato", "potato", "onion", "garlic", "spice", "herb"
+]
+
+# Common allergen keywords; any of them in the ingredients disqualifies an allergen-free product
+ALLERGEN_KEYWORDS = [
+    # Gluten sources
+    "wheat", "barley", "rye", "oat", "spelt", "kamut", "gluten",
+    # Dairy
+    "milk", "cream", "butter", "cheese", "lactose", "whey", "casein", "dairy",
+    # Eggs
+    "egg", "albumin", "mayonnaise",
+    # Nuts
+    "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia",
+    "brazil nut", "chestnut", "nut",
+    # Peanuts
+    "peanut", "groundnut", "arachis",
+    # Soy
+    "soy", "soya", "edamame", "tofu", "tempeh",
+    # Fish
+    "fish", "salmon", "tuna", "cod", "anchovy", "sardine", "mackerel",
+    # Shellfish/Crustaceans
+    "shrimp", "prawn", "crab", "lobster", "crayfish", "shellfish", "crustacean",
+    # Molluscs
+    "oyster", "mussel", "clam", "scallop", "squid", "octopus", "mollusc",
+    # Sesame
+    "sesame", "tahini",
+    # Mustard
+    "mustard",
+    # Celery
+    "celery", "celeriac",
+    # Lupin
+    "lupin", "lupine",
+    # Sulphites
+    "sulphite", "sulfite", "sulphur dioxide", "sulfur dioxide",
+]
+
+
+def compile_keyword_pattern(keywords):
+    """
+    Compile keywords into one regex shaped like a trie, so a single search finds
+    any of them in one scan (shared prefixes are only matched once).
+    A flat "a|b|c" alternation retries every keyword at every position instead.
+    """
+    # A keyword that contains another keyword can never be the only match ("walnut"
+    # contains "nut", "soya" contains "soy"), so it is left out of the pattern
+    keywords = [keyword for keyword in keywords
+                if not any(other != keyword and other in keyword for other in keywords)]
+
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End of a keyword
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A keyword ending here makes the rest of the branch optional
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(build(trie))
+
+
+ALLERGEN_KEYWORD_PATTERN = compile_keyword_pattern(ALLERGEN_KEYWORDS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second on average, bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping only when the bucket is empty"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going negative reserves the next free slot, so waiting threads queue up fairly
+            self.tokens -= 1
+            wait_time = -self.tokens / self.rate
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+RATE_LIMIT = TokenBucket(REQUESTS_PER_MINUTE / 60, REQUEST_BURST)
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that takes a RATE_LIMIT token before each request goes out and notes
+    how long the server took to answer on the response (as `latency`). Responses served
+    from the local cache never reach the adapter, so they are neither throttled nor timed.
+    """
+
+    def send(self, request, **kwargs):
+        RATE_LIMIT.acquire()
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        response.latency = time.monotonic() - start
+        return response
+
+
+def create_session(use_cache=True):
+    """Create the HTTP session used by all searches, optionally backed by the response cache"""
+    if use_cache:
+        session = CachedSession(CACHE_NAME, backend="sqlite", expire_after=CACHE_EXPIRE_SECONDS)
+    else:
+        session = requests.Session()
+    # Every request goes to the same host; keep one reusable connection per worker thread
+    session.mount("https://", ThrottledAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+    return session
+
+
+def read_timeout(kind, default_timeout, attempt=0):
+    """Read timeout for a search, from recent response times of its kind when there are enough of them"""
+    with LATENCIES_LOCK:
+        samples = list(LATENCIES[kind])
+    if len(samples) < 10:
+        base = default_timeout
+    else:
+        base = 2.0 * statistics.quantiles(samples, n=100)[98]
+    # Retries get longer, but never past the search's fixed timeout
+    return max(MIN_READ_TIMEOUT, min(default_timeout, base * 2 ** attempt))
+
+
+def search_get(params, kind, default_timeout, attempt=0):
+    """GET the search URL with an adaptive read timeout, recording the response time under `kind`"""
+    response = SESSION.get(SEARCH_URL, params=params,
+                           timeout=(CONNECT_TIMEOUT, read_timeout(kind, default_timeout, attempt)))
+    latency = getattr(response, "latency", None)
+    if latency is not None:
+        with LATENCIES_LOCK:
+            LATENCIES[kind].append(latency)
+    return response
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retrying: exponential backoff with jitter, so parallel
+    requests don't retry in lockstep. A numeric Retry-After from the server is honoured.
+    """
+    wait_time = min(RETRY_MAX_WAIT, 2 ** attempt) * random.uniform(0.5, 1.5)
+    if retry_after and retry_after.strip().isdigit():
+        wait_time = max(wait_time, int(retry_after))
+    return wait_time
+
+
+def fetch_products(params, kind, default_timeout, description, max_retries=3):
+    """
+    Run a search and return its products. Timeouts, connection errors and rate limiting
+    (HTTP 429) are retried with backoff; after `max_retries` attempts the page is skipped.
+    """
+    for attempt in range(max_retries):
+        try:
+            response = search_get(params, kind, default_timeout, attempt=attempt)
+            if response.status_code == 429:
+                problem = "Rate limited"
+                wait_time = backoff_delay(attempt, response.headers.get("Retry-After"))
+            else:
+                response.raise_for_status()
+                return orjson.loads(response.content).get("products", [])
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            problem = "Timeout" if isinstance(e, requests.exceptions.Timeout) else "Connection error"
+            wait_time = backoff_delay(attempt)
+        except Exception as e:
+            print(f"Error fetching {description}: {e}")
+            return []
+
+        if STOP_REQUESTED.is_set():
+            return []  # Shutting down, so don't wait to retry
+        if attempt + 1 < max_retries:
+            print(f"  {problem} on attempt {attempt + 1}/{max_retries}, waiting {wait_time:.1f}s...")
+            time.sleep(wait_time)
+
+    print(f"  Failed after {max_retries} attempts, skipping page {params['page']} of {description}")
+    return []
+
 
 def search_products(page=1, page_size=100, with_allergens=True):
     """Search for products with or without allergens"""
@@ -28,7 +337,7 @@ def search_products(page=1, page_size=100, with_allergens=True):
         "tagtype_1": "states",
         "tag_contains_1": "contains",
         "tag_1": "ingredients-completed",
-        "fields": "code,product_name,ingredients_text_en,allergens_tags,url",
+        "fields": "code,product_name,ingredients_text_en,allergens_tags",
         "page_size": page_size,
         "page": page,
         "json": 1,
@@ -40,13 +349,7 @@ def search_products(page=1, page_size=100, with_allergens=True):
         params["tag_contains_2"] = "contains"
         params["tag_2"] = "en:gluten"  # Start with common allergen
 
-    try:
-        response = requests.get(SEARCH_URL, params=params, timeout=30)
-        response.raise_for_status()
-        return response.json().get("products", [])
-    except Exception as e:
-        print(f"Error fetching data: {e}")
-        return []
+    return fetch_products(params, "products", 30, "data")
 
 
 def search_by_allergen(allergen_tag, page=1, page_size=50):
@@ -62,20 +365,14 @@ def search_by_allergen(allergen_tag, page=1, page_size=50):
         "tagtype_2": "countries",
         "tag_contains_2": "contains",
         "tag_2": "en:united-states",  # Primary filter: USA
-        "fields": "code,product_name,ingredients_text_en,allergens_tags,countries_tags,url",
+        "fields": "code,product_name,ingredients_text_en,allergens_tags,countries_tags",
         "page_size": page_size,
         "page": page,
         "json": 1,
         "sort_by": "unique_scans_n"
     }
 
-    try:
-        response = requests.get(SEARCH_URL, params=params, timeout=30)
-        response.raise_for_status()
-        return response.json().get("products", [])
-    except Exception as e:
-        print(f"Error fetching allergen {allergen_tag}: {e}")
-        return []
+    return fetch_products(params, "by_allergen", 30, f"allergen {allergen_tag}")
 
 
 def search_without_allergens(page=1, page_size=50, max_retries=3, country="en:united-states"):
@@ -91,87 +388,72 @@ def search_without_allergens(page=1, page_size=50, max_retries=3, country="en:un
         "tagtype_2": "countries",
         "tag_contains_2": "contains",
         "tag_2": country,
-        "fields": "code,product_name,ingredients_text_en,allergens_tags,traces_tags,countries_tags,url",
+        "fields": "code,product_name,ingredients_text_en,allergens_tags,traces_tags,countries_tags",
         "page_size": page_size,
         "page": page,
         "json": 1,
         "sort_by": "unique_scans_n"
     }
 
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(SEARCH_URL, params=params, timeout=60)
-            response.raise_for_status()
-            return response.json().get("products", [])
-        except requests.exceptions.Timeout:
-            wait_time = (attempt + 1) * 5
-            print(f"  Timeout on attempt {attempt + 1}/{max_retries}, waiting {wait_time}s...")
-            time.sleep(wait_time)
-        except Exception as e:
-            print(f"Error fetching products without allergens: {e}")
-            return []
+    return fetch_products(params, "without_allergens", 60, "products without allergens", max_retries)
 
-    print(f"  Failed after {max_retries} attempts, skipping page {page}")
-    return []
+
+# Allergen targets for diversity (total = 150)
+ALLERGEN_TARGETS = {
+    "en:milk": 20,           # Dairy products
+    "en:eggs": 18,           # Egg products
+    "en:peanuts": 15,        # Peanut products
+    "en:nuts": 12,           # Tree nuts
+    "en:fish": 12,           # Fish products
+    "en:crustaceans": 10,    # Shellfish/crustaceans
+    "en:soybeans": 15,       # Soy products
+    "en:sesame-seeds": 12,   # Sesame products
+    "en:mustard": 8,         # Mustard products
+    "en:celery": 8,          # Celery products
+    "en:lupin": 5,           # Lupin products
+    "en:molluscs": 5,        # Molluscs
+    "en:gluten": 10,         # Gluten (wheat) - kept low since it appears with others
+}
+
+
+def tag_label(tag):
+    """Readable label for an allergen tag (e.g., "en:sesame-seeds" -> "Sesame Seeds")"""
+    return tag.split(":")[-1].replace("-", " ").title()
+
+
+class TagLabels(dict):
+    """Allergen tag -> readable label, filled in the first time an unknown tag is seen"""
+
+    def __missing__(self, tag):
+        label = self[tag] = tag_label(tag)
+        return label
+
+
+# Labels for the searched allergen tags are built up front
+TAG_LABELS = TagLabels({tag: tag_label(tag) for tag in ALLERGEN_TARGETS})
+
+
+@lru_cache(maxsize=None)
+def _format_allergen_tags(allergens_tags):
+    """Format a tuple of allergen tags; tag combinations repeat heavily across products"""
+    return ", ".join([TAG_LABELS[tag] for tag in allergens_tags])
 
 
 def format_allergens(allergens_tags):
     """Format allergens from tags to readable string"""
     if not allergens_tags:
         return ""
-
-    allergens = []
-    for tag in allergens_tags:
-        # Remove language prefix (e.g., "en:gluten" -> "Gluten")
-        if ":" in tag:
-            allergen = tag.split(":")[-1]
-        else:
-            allergen = tag
-        allergen = allergen.replace("-", " ").title()
-        allergens.append(allergen)
-
-    return ", ".join(allergens)
+    # Tuple rather than frozenset so the output keeps the tag order
+    return _format_allergen_tags(tuple(allergens_tags))
 
 
 def clean_text(text):
     """Clean text by removing semicolons, newlines, emojis, and special symbols"""
     if not text:
         return ""
-    text = str(text)
-    text = text.replace(";", ",")
-    text = text.replace("\n", " ")
-    text = text.replace("\r", " ")
-
-    # Remove common special symbols
-    special_symbols = ["•", "·", "●", "○", "■", "□", "▪", "▫", "►", "◄", "★", "☆",
-                       "→", "←", "↑", "↓", "«", "»", "™", "®", "©", "°", "±",
-                       "¹", "²", "³", "¼", "½", "¾", "×", "÷", "†", "‡", "§", "¶",
-                       "…", "‹", "›", "€", "£", "¥", "¢", "₹", "฿",
-                       "_", "*"]  # underscore and asterisk
-    for symbol in special_symbols:
-        text = text.replace(symbol, " ")
-
-    # Remove emojis and other unicode symbols
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags
-        "\U00002702-\U000027B0"  # dingbats
-        "\U000024C2-\U0001F251"  # enclosed characters
-        "\U0001F900-\U0001F9FF"  # supplemental symbols
-        "\U0001FA00-\U0001FA6F"  # chess symbols
-        "\U0001FA70-\U0001FAFF"  # symbols extended
-        "\U00002600-\U000026FF"  # misc symbols
-        "\U00002022"             # bullet point •
-        "\U000000B7"             # middle dot ·
-        "]+",
-        flags=re.UNICODE
-    )
-    text = emoji_pattern.sub("", text)
-    text = " ".join(text.split())  # Normalize whitespace
-    return text
+    # Single pass: separators and special symbols are replaced, emojis are dropped
+    text = str(text).translate(CLEAN_TABLE)
+    return " ".join(text.split())  # Normalize whitespace
 
 
 def is_from_allowed_country(product):
@@ -187,115 +469,109 @@ def is_from_allowed_country(product):
     return False
 
 
-def is_english_text(text):
+def count_non_ascii(text):
+    """Count characters above code point 127; most product text is pure ASCII and returns at once"""
+    if text.isascii():
+        return 0
+    return len(text) - len(text.encode("ascii", "ignore"))
+
+
+def contains_at_least(text, words, count):
+    """Check whether at least `count` of the words occur in text, stopping as soon as they do"""
+    for word in words:
+        if word in text:
+            count -= 1
+            if not count:
+                return True
+    return False
+
+
+def is_english_text(text, text_lower=None):
     """
     Check if text is primarily in English.
     Returns False if text contains too many non-English characters or patterns.
+    Callers that already lowercased the text can pass it as text_lower.
     """
     if not text or len(text) < 5:
         return False
 
-    text_lower = text.lower()
-
     # Check for non-ASCII characters (non-English alphabets)
-    non_ascii_count = sum(1 for char in text if ord(char) > 127)
+    non_ascii_count = count_non_ascii(text)
     non_ascii_ratio = non_ascii_count / len(text)
 
     # If more than 10% non-ASCII characters, likely not English
     if non_ascii_ratio > 0.10:
         return False
 
-    # Common non-English patterns to reject
-    non_english_patterns = [
-        # French
-        "é", "è", "ê", "ë", "à", "â", "ô", "î", "ï", "ù", "û", "ç", "œ", "æ",
-        # German
-        "ä", "ö", "ü", "ß",
-        # Spanish/Portuguese
-        "ñ", "ã", "õ",
-        # Arabic
-        "ال", "من", "في",
-        # Chinese/Japanese/Korean (check for character ranges)
-        # Other indicators
-        "ingrédients", "zucker", "azúcar", "açúcar", "zutaten",
-        "sucre", "farine", "huile", "lait", "beurre", "œufs",
-        "leche", "harina", "aceite", "mantequilla",
-        "milch", "mehl", "öl", "butter", "eier",
-    ]
-
-    # Count non-English pattern matches
-    non_english_matches = sum(1 for pattern in non_english_patterns if pattern in text_lower)
+    if text_lower is None:
+        text_lower = text.lower()
 
     # If too many non-English patterns found, reject
-    if non_english_matches >= 3:
+    if contains_at_least(text_lower, NON_ENGLISH_PATTERNS, 3):
         return False
 
-    # Check for common English food words (positive indicator)
-    english_food_words = [
-        "sugar", "salt", "water", "oil", "flour", "milk", "cream", "butter",
-        "egg", "wheat", "contains", "ingredients", "natural", "flavor",
-        "extract", "powder", "syrup", "acid", "vitamin", "protein",
-        "modified", "starch", "emulsifier", "preservative", "color",
-        "artificial", "organic", "whole", "enriched", "dried"
-    ]
+    # Should have at least some English food words
+    return contains_at_least(text_lower, ENGLISH_FOOD_WORDS, 2)
 
-    english_matches = sum(1 for word in english_food_words if word in text_lower)
 
-    # Should have at least some English food words
-    if english_matches < 2:
-        return False
+def memoize_by_code(check):
+    """Cache a product check by product code; the same products come back on many result pages"""
+    results = {}
 
-    return True
+    @wraps(check)
+    def cached(product):
+        code = product.get("code")
+        if not code:
+            return check(product)
+        result = results.get(code)
+        if result is None:
+            result = results[code] = check(product)
+        return result
+
+    return cached
 
 
-def is_valid_product(product, require_allergens=True):
+@memoize_by_code
+def is_valid_product(product):
     """Check if product has required fields, valid ingredient data, and is in English"""
-    code = product.get("code", "")
     name = product.get("product_name", "")
     ingredients = product.get("ingredients_text_en", "")
-    allergens = product.get("allergens_tags", [])
-
-    if not code or not name or not ingredients:
-        return False
 
-    if len(ingredients) < 10:  # Too short to be useful
+    # Too short ingredient lists are not useful
+    if not product.get("code") or not name or not ingredients or len(ingredients) < 10:
         return False
 
     # Check that product name is in English (no excessive non-ASCII)
-    name_non_ascii = sum(1 for char in name if ord(char) > 127)
+    name_non_ascii = count_non_ascii(name)
     if len(name) > 0 and (name_non_ascii / len(name)) > 0.15:
         return False  # Product name has too many non-English characters
 
-    # Check that ingredients are in English
-    if not is_english_text(ingredients):
+    # Check that ingredients are in English (lowercased once for both keyword checks)
+    ingredients_lower = ingredients.lower()
+    if not is_english_text(ingredients, ingredients_lower):
         return False
 
     # Validate ingredients contain actual food-related content
     # Check for common food words to filter out garbage data
-    ingredients_lower = ingredients.lower()
-    food_indicators = [
-        "sugar", "salt", "water", "oil", "flour", "milk", "cream", "butter",
-        "egg", "wheat", "corn", "rice", "starch", "extract", "flavor",
-        "acid", "vitamin", "protein", "fat", "sodium", "calcium",
-        "natural", "organic", "powder", "syrup", "juice", "puree",
-        "vegetable", "fruit", "meat", "fish", "chicken", "beef",
-        "tomato", "potato", "onion", "garlic", "spice", "herb"
-    ]
-
-    has_food_content = any(word in ingredients_lower for word in food_indicators)
+    has_food_content = any(word in ingredients_lower for word in FOOD_INDICATORS)
     if not has_food_content:
         return False  # Likely garbage data
 
     # Check country (must be USA or UK)
-    if not is_from_allowed_country(product):
-        return False
+    return is_from_allowed_country(product)
 
-    if require_allergens:
-        return len(allergens) > 0
-    else:
-        return len(allergens) == 0
 
+def _valid_with_allergens(product):
+    """is_valid_product for the allergen phase; the cheap tag check runs first"""
+    return bool(product.get("allergens_tags")) and is_valid_product(product)
 
+
+def _valid_without_allergens(product):
+    """is_valid_product for the allergen-free phase; the cheap tag check runs first"""
+    return not product.get("allergens_tags") and is_valid_product(product)
+
+
+@memoize_by_code
 def is_truly_allergen_free(product):
     """
     Strict validation to ensure product is 100% allergen-free.
@@ -311,45 +587,13 @@ def is_truly_allergen_free(product):
     if traces and len(traces) > 0:
         return False
 
-    # Check ingredients text for common allergen keywords
+    # Check ingredients text for common allergen keywords (one scan for all of them).
+    # Plain substring matching on purpose: plurals and compounds ("nuts", "oats", "eggs",
+    # "wheatgrass") must still disqualify, which word boundaries would let through.
+    # Lowercasing first is also ~4x faster than compiling the pattern with re.IGNORECASE
     ingredients = product.get("ingredients_text_en", "").lower()
-
-    # Common allergen keywords to check in ingredients
-    allergen_keywords = [
-        # Gluten sources
-        "wheat", "barley", "rye", "oat", "spelt", "kamut", "gluten",
-        # Dairy
-        "milk", "cream", "butter", "cheese", "lactose", "whey", "casein", "dairy",
-        # Eggs
-        "egg", "albumin", "mayonnaise",
-        # Nuts
-        "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia",
-        "brazil nut", "chestnut", "nut",
-        # Peanuts
-        "peanut", "groundnut", "arachis",
-        # Soy
-        "soy", "soya", "edamame", "tofu", "tempeh",
-        # Fish
-        "fish", "salmon", "tuna", "cod", "anchovy", "sardine", "mackerel",
-        # Shellfish/Crustaceans
-        "shrimp", "prawn", "crab", "lobster", "crayfish", "shellfish", "crustacean",
-        # Molluscs
-        "oyster", "mussel", "clam", "scallop", "squid", "octopus", "mollusc",
-        # Sesame
-        "sesame", "tahini",
-        # Mustard
-        "mustard",
-        # Celery
-        "celery", "celeriac",
-        # Lupin
-        "lupin", "lupine",
-        # Sulphites
-        "sulphite", "sulfite", "sulphur dioxide", "sulfur dioxide",
-    ]
-
-    for keyword in allergen_keywords:
-        if keyword in ingredients:
-            return False
+    if ALLERGEN_KEYWORD_PATTERN.search(ingredients):
+        return False
 
     return True
 
@@ -367,116 +611,144 @@ def search_by_allergen_country(allergen_tag, country, page=1, page_size=50):
         "tagtype_2": "countries",
         "tag_contains_2": "contains",
         "tag_2": country,
-        "fields": "code,product_name,ingredients_text_en,allergens_tags,countries_tags,url",
+        "fields": "code,product_name,ingredients_text_en,allergens_tags,countries_tags",
         "page_size": page_size,
         "page": page,
         "json": 1,
         "sort_by": "unique_scans_n"
     }
 
-    try:
-        response = requests.get(SEARCH_URL, params=params, timeout=30)
-        response.raise_for_status()
-        return response.json().get("products", [])
-    except Exception as e:
-        print(f"Error fetching allergen {allergen_tag} for {country}: {e}")
-        return []
+    return fetch_products(params, "by_allergen_country", 30, f"allergen {allergen_tag} for {country}")
 
 
-def collect_products_with_allergens(target_count=150):
+def fetch_in_order(pool, searches):
+    """
+    Run (key, fetch) pairs on the pool with up to FETCH_WINDOW requests in flight.
+    `searches` is consumed lazily, so it can stop producing requests once a search is satisfied.
+    Yields (key, products) in request order; stop iterating to cancel requests not yet started.
+    """
+    pending = deque()
+    try:
+        for key, fetch in searches:
+            pending.append((key, pool.submit(fetch)))
+            if len(pending) >= FETCH_WINDOW:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def collect_products_with_allergens(pool, target_count=150):
     """Collect products WITH allergens ensuring diversity (USA & UK only)"""
     collected = {}
     allergen_counts = {}  # Track count per primary allergen
 
-    # Allergen targets for diversity (total = 150)
-    allergen_targets = {
-        "en:milk": 20,           # Dairy products
-        "en:eggs": 18,           # Egg products
-        "en:peanuts": 15,        # Peanut products
-        "en:nuts": 12,           # Tree nuts
-        "en:fish": 12,           # Fish products
-        "en:crustaceans": 10,    # Shellfish/crustaceans
-        "en:soybeans": 15,       # Soy products
-        "en:sesame-seeds": 12,   # Sesame products
-        "en:mustard": 8,         # Mustard products
-        "en:celery": 8,          # Celery products
-        "en:lupin": 5,           # Lupin products
-        "en:molluscs": 5,        # Molluscs
-        "en:gluten": 10,         # Gluten (wheat) - kept low since it appears with others
-    }
-
     # Countries to search
     countries = ["en:united-states", "en:united-kingdom"]
 
     print(f"Collecting {target_count} products WITH allergens (USA & UK only)...")
     print("Target distribution:")
-    for allergen, target in allergen_targets.items():
+    for allergen, target in ALLERGEN_TARGETS.items():
         print(f"  {allergen}: {target}")
     print()
 
-    for allergen, target in allergen_targets.items():
-        allergen_counts[allergen] = 0
+    # Up to 3 pages of 100 per allergen per country: fewer, larger pages mean fewer round trips
+    page_size = 100
+    last_pages = set()  # (allergen, country) searches whose results ran out
+
+    def searches():
+        for allergen, target in ALLERGEN_TARGETS.items():
+            for country in countries:
+                for page in range(1, 4):
+                    if len(collected) >= target_count or STOP_REQUESTED.is_set():
+                        return
+                    if (allergen, country) in last_pages:
+                        break
+                    if allergen_counts.get(allergen, 0) < target:
+                        yield (allergen, country), partial(search_by_allergen_country, allergen, country,
+                                                           page, page_size=page_size)
 
+    current_allergen = current_search = None
+    for (allergen, country), products in fetch_in_order(pool, searches()):
         if len(collected) >= target_count:
             break
 
-        print(f"  Searching for {allergen} (target: {target})...")
-
-        # Search in both USA and UK
-        for country in countries:
-            if allergen_counts[allergen] >= target or len(collected) >= target_count:
-                break
-
+        target = ALLERGEN_TARGETS[allergen]
+        if allergen != current_allergen:
+            if current_allergen is not None:
+                print(f"  Collected {allergen_counts[current_allergen]} for {current_allergen}")
+            current_allergen = allergen
+            allergen_counts[allergen] = 0
+            bare_allergen = allergen.replace("en:", "")
+            print(f"  Searching for {allergen} (target: {target})...")
+
+        # Pages requested before the target was reached, or past the last page, are dropped
+        if allergen_counts[allergen] >= target or (allergen, country) in last_pages:
+            continue
+
+        # A short page is the last one for this search
+        if 0 < len(products) < page_size:
+            last_pages.add((allergen, country))
+
+        if (allergen, country) != current_search:
+            current_search = (allergen, country)
+            duplicate_streak = 0  # Already-collected products seen since the last new one
             country_name = "USA" if "united-states" in country else "UK"
             print(f"    Searching in {country_name}...")
 
-            for page in range(1, 6):  # Up to 6 pages per allergen per country
-                if allergen_counts[allergen] >= target or len(collected) >= target_count:
-                    break
-
-                products = search_by_allergen_country(allergen, country, page=page, page_size=50)
-
-                for product in products:
-                    if allergen_counts[allergen] >= target or len(collected) >= target_count:
-                        break
+        for product in products:
+            if allergen_counts[allergen] >= target or len(collected) >= target_count:
+                break
 
-                    code = product.get("code", "")
-                    allergens_tags = product.get("allergens_tags", [])
+            code = product.get("code", "")
+            allergens_tags = product.get("allergens_tags", [])
 
-                    # Skip if already collected
-                    if not code or code in collected:
-                        continue
+            if not code:
+                continue
 
-                    # For non-gluten allergens, prefer products where this allergen is primary
-                    if allergen != "en:gluten":
-                        has_target_allergen = any(allergen in tag or allergen.replace("en:", "") in tag
-                                                  for tag in allergens_tags)
-                        if not has_target_allergen:
-                            continue
+            # Skip if already collected; a long run of them means this search is exhausted
+            if code in collected:
+                duplicate_streak += 1
+                if duplicate_streak > DUPLICATE_STREAK_LIMIT:
+                    last_pages.add((allergen, country))
+                    break
+                continue
 
-                    if is_valid_product(product, require_allergens=True):
-                        collected[code] = product
-                        allergen_counts[allergen] += 1
-                        allergen_name = allergen.replace("en:", "").replace("-", " ").title()
-                        print(f"      [{allergen_name}] Found: {allergen_counts[allergen]}/{target} (Total: {len(collected)}/{target_count})")
+            # For non-gluten allergens, prefer products where this allergen is primary.
+            # An exact tag match is the common case; otherwise fall back to a substring check
+            # (the bare name covers the prefixed form, and can't span the newline between tags)
+            if allergen != "en:gluten" and allergen not in allergens_tags:
+                if bare_allergen not in "\n".join(allergens_tags):
+                    continue
 
-                time.sleep(0.5)  # Rate limiting
+            if _valid_with_allergens(product):
+                collected[code] = product
+                allergen_counts[allergen] += 1
+                duplicate_streak = 0
+                allergen_name = TAG_LABELS[allergen]
+                print(f"      [{allergen_name}] Found: {allergen_counts[allergen]}/{target} (Total: {len(collected)}/{target_count})")
 
-        print(f"  Collected {allergen_counts[allergen]} for {allergen}")
+    if current_allergen is not None:
+        print(f"  Collected {allergen_counts[current_allergen]} for {current_allergen}")
 
     # Print summary
     print("\nAllergen collection summary:")
     for allergen, count in allergen_counts.items():
-        target = allergen_targets.get(allergen, 0)
+        target = ALLERGEN_TARGETS.get(allergen, 0)
         status = "✓" if count >= target else "✗"
         print(f"  {status} {allergen}: {count}/{target}")
 
     return list(collected.values())
 
 
-def collect_products_without_allergens(target_count=50):
+def collect_products_without_allergens(pool, target_count=50):
     """Collect products that are 100% allergen-free (USA & UK only)"""
     collected = {}
+    exhausted = set()  # Countries with no more result pages
 
     # Countries to search
     countries = ["en:united-states", "en:united-kingdom"]
@@ -484,43 +756,59 @@ def collect_products_without_allergens(target_count=50):
     print(f"\nCollecting {target_count} products WITHOUT any allergens (USA & UK only)...")
     print("Checking: allergen tags, traces tags, AND ingredient keywords\n")
 
-    for country in countries:
+    # More pages since strict filtering reduces matches; large pages keep the round trips down
+    page_size = 250
+
+    def searches():
+        for country in countries:
+            for page in range(1, 13):
+                if len(collected) >= target_count or STOP_REQUESTED.is_set():
+                    return
+                if country in exhausted:
+                    break
+                yield (country, page), partial(search_without_allergens, page, page_size=page_size, country=country)
+
+    current_country = None
+    for (country, page), products in fetch_in_order(pool, searches()):
         if len(collected) >= target_count:
             break
 
-        country_name = "USA" if "united-states" in country else "UK"
-        print(f"  Searching in {country_name}...")
+        # Pages requested past the last result page are dropped
+        if country in exhausted:
+            continue
 
-        for page in range(1, 30):  # More pages since strict filtering reduces matches
-            if len(collected) >= target_count:
-                break
+        if country != current_country:
+            current_country = country
+            country_name = "USA" if "united-states" in country else "UK"
+            print(f"  Searching in {country_name}...")
 
-            products = search_without_allergens(page=page, page_size=100, country=country)
+        if not products:
+            print(f"    No more products found at page {page}")
+            exhausted.add(country)
+            continue
 
-            if not products:
-                print(f"    No more products found at page {page}")
-                break
+        # A short page is the last one for this country
+        if len(products) < page_size:
+            exhausted.add(country)
 
-            for product in products:
-                if len(collected) >= target_count:
-                    break
-
-                code = product.get("code", "")
+        for product in products:
+            if len(collected) >= target_count:
+                break
 
-                # Skip if already collected or invalid
-                if not code or code in collected:
-                    continue
+            code = product.get("code", "")
 
-                if not is_valid_product(product, require_allergens=False):
-                    continue
+            # Skip if already collected or invalid
+            if not code or code in collected:
+                continue
 
-                # STRICT validation: 100% allergen-free
-                if is_truly_allergen_free(product):
-                    collected[code] = product
-                    name = product.get("product_name", "")[:40]
-                    print(f"    Found: {len(collected)}/{target_count} - {name}")
+            if not _valid_without_allergens(product):
+                continue
 
-            time.sleep(0.5)
+            # STRICT validation: 100% allergen-free
+            if is_truly_allergen_free(product):
+                collected[code] = product
+                name = product.get("product_name", "")[:40]
+                print(f"    Found: {len(collected)}/{target_count} - {name}")
 
     if len(collected) < target_count:
         print(f"\n  Warning: Only found {len(collected)} truly allergen-free products")
@@ -530,35 +818,55 @@ def collect_products_without_allergens(target_count=50):
 
 def save_to_file(products, filename="foodraw.txt"):
     """Save products to semicolon-separated file"""
-    with open(filename, "w", encoding="utf-8") as f:
-        for idx, product in enumerate(products, 1):
-            code = product.get("code", "")
-            name = clean_text(product.get("product_name", ""))
-            ingredients = clean_text(product.get("ingredients_text_en", ""))
-            allergens = format_allergens(product.get("allergens_tags", []))
-
-            # Build the URL
-            url = f"https://world.openfoodfacts.org/product/{code}"
+    # Format: id;name;ingredients;allergens;link
+    lines = [
+        f"{idx};{clean_text(product.get('product_name', ''))};"
+        f"{clean_text(product.get('ingredients_text_en', ''))};"
+        f"{format_allergens(product.get('allergens_tags', []))};"
+        f"{BASE_URL}/product/{product.get('code', '')}\n"
+        for idx, product in enumerate(products, 1)
+    ]
 
-            # Format: id;name;ingredients;allergens;link
-            line = f"{idx};{name};{ingredients};{allergens};{url}\n"
-            f.write(line)
+    # Write everything in one call through a large buffer
+    with open(filename, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(lines)
 
     print(f"\nSaved {len(products)} products to {filename}")
 
 
 def main():
+    global SESSION
+
+    parser = argparse.ArgumentParser(description="Collect food products from the Open Food Facts API")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"always query the API instead of reusing cached responses ({CACHE_NAME}.sqlite)")
+    args = parser.parse_args()
+
+    SESSION = create_session(use_cache=not args.no_cache)
+
     print("=" * 60)
     print("Open Food Facts Data Collection")
     print("=" * 60)
 
-    # Collect products with allergens (150)
-    products_with_allergens = collect_products_with_allergens(150)
-    print(f"\nCollected {len(products_with_allergens)} products with allergens")
-
-    # Collect products without allergens (50)
-    products_without_allergens = collect_products_without_allergens(50)
-    print(f"Collected {len(products_without_allergens)} products without allergens")
+    # One pool serves every page request of both collection phases. The phases share
+    # nothing but the pool, so the allergen-free one runs alongside on its own thread
+    # (their progress output interleaves). Both draw on the one RATE_LIMIT, so total
+    # time still follows the number of requests sent
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool, ThreadPoolExecutor(max_workers=1) as phases:
+        try:
+            # Collect products without allergens (50)
+            without_allergens_future = phases.submit(collect_products_without_allergens, pool, 50)
+
+            # Collect products with allergens (150)
+            products_with_allergens = collect_products_with_allergens(pool, 150)
+            print(f"\nCollected {len(products_with_allergens)} products with allergens")
+
+            products_without_allergens = without_allergens_future.result()
+            print(f"Collected {len(products_without_allergens)} products without allergens")
+        finally:
+            # On an error or Ctrl-C, don't let the executors wait for the other phase to
+            # page through everything it has left (a no-op once both phases are done)
+            STOP_REQUESTED.set()
 
     # Combine all products
     all_products = products_with_allergens + products_without_allergens
@@ -16,8 +16,10 @@ Creates foodpreprocessed.xlsx with allergensmapped column
 """
 
 import re
+from functools import lru_cache
 from openpyxl import load_workbook, Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 
 # Mapping rules for nine common allergens
 ALLERGEN_MAPPINGS = {
@@ -80,6 +82,66 @@ ALLERGEN_MAPPINGS = {
 }
 
 
+def compile_keyword_scanner(mappings):
+    """
+    Compile every mapping keyword into one regex shaped like a trie, so a single
+    findall pass replaces a separate word-boundary search per keyword.
+    At each word boundary the scan captures the longest keyword that also ends on a
+    word boundary. Returns the pattern and, per keyword, the set of categories it implies.
+    """
+    categories = {}
+    for category, keywords in mappings.items():
+        for keyword in keywords:
+            categories.setdefault(keyword, set()).add(category)
+
+    # A keyword found by the scan also stands for every shorter keyword it starts with
+    # that ends on a word boundary ("peanut butter" -> "peanut"), which the scan skips
+    implied = {
+        keyword: frozenset().union(*[cats for other, cats in categories.items()
+                                     if re.match(re.escape(other) + r"\b", keyword)])
+        for keyword in categories
+    }
+
+    trie = {}
+    for keyword in categories:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End of a keyword
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A keyword ending here makes the rest of the branch optional (longest match first)
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(r"\b(?=(" + build(trie) + r")\b)"), implied
+
+
+KEYWORD_PATTERN, KEYWORD_CATEGORIES = compile_keyword_scanner(ALLERGEN_MAPPINGS)
+
+# One bit per category, so a row's matches fold into an int and every possible
+# combination has its output string prepared up front
+CATEGORY_BITS = {category: 1 << index for index, category in enumerate(ALLERGEN_MAPPINGS)}
+KEYWORD_MASKS = {
+    keyword: sum(CATEGORY_BITS[category] for category in categories)
+    for keyword, categories in KEYWORD_CATEGORIES.items()
+}
+MASK_TO_STR = [
+    ", ".join(sorted(category for category, bit in CATEGORY_BITS.items() if mask & bit))
+    for mask in range(1 << len(CATEGORY_BITS))
+]
+
+# Rows that are pure ASCII (nearly all of them) are scanned as bytes, which skips
+# the Unicode-aware matching; other rows keep the str pattern so word boundaries
+# around accented letters behave the same
+ASCII_KEYWORD_PATTERN = re.compile(KEYWORD_PATTERN.pattern.encode("ascii"))
+ASCII_KEYWORD_MASKS = {keyword.encode("ascii"): mask for keyword, mask in KEYWORD_MASKS.items()}
+
+
+@lru_cache(maxsize=8192)
 def map_to_common_allergens(allergen_text):
     """
     Map allergen text to the nine common allergens
@@ -88,20 +150,31 @@ def map_to_common_allergens(allergen_text):
     if not allergen_text or allergen_text.strip() == "":
         return ""
 
-    allergen_lower = allergen_text.lower()
-    found_allergens = set()
+    found_mask = 0
+
+    # Word boundary matching to avoid partial matches, all keywords in one scan
+    if allergen_text.isascii():
+        for keyword in ASCII_KEYWORD_PATTERN.findall(allergen_text.encode("ascii").lower()):
+            found_mask |= ASCII_KEYWORD_MASKS[keyword]
+    else:
+        for keyword in KEYWORD_PATTERN.findall(allergen_text.lower()):
+            found_mask |= KEYWORD_MASKS[keyword]
+
+    # Sorted alphabetically for consistency
+    return MASK_TO_STR[found_mask]
 
-    for common_allergen, keywords in ALLERGEN_MAPPINGS.items():
-        for keyword in keywords:
-            # Use word boundary matching to avoid partial matches
-            pattern = r'\b' + re.escape(keyword) + r'\b'
-            if re.search(pattern, allergen_lower):
-                found_allergens.add(common_allergen)
-                break
 
-    # Sort alphabetically for consistency
-    sorted_allergens = sorted(found_allergens)
-    return ", ".join(sorted_allergens)
+# Shared header and border styles, built once instead of on every call
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+WRAPPED_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+THIN_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
 
 
 def process_excel(input_file="foodraw.xlsx", output_file="foodpreprocessed.xlsx"):
@@ -126,23 +199,16 @@ def process_excel(input_file="foodraw.xlsx", output_file="foodpreprocessed.xlsx"
     # Add new column header for allergensmapped
     new_col = len(headers) + 1
 
-    # Style for header
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Data cells share one registered style instead of each getting its own border
+    if "bordered" not in wb.named_styles:
+        wb.add_named_style(NamedStyle(name="bordered", border=THIN_BORDER))
 
     # Add header for new column
     header_cell = ws.cell(row=1, column=new_col, value="allergensmapped")
-    header_cell.font = header_font
-    header_cell.fill = header_fill
-    header_cell.alignment = header_alignment
-    header_cell.border = thin_border
+    header_cell.font = HEADER_FONT
+    header_cell.fill = HEADER_FILL
+    header_cell.alignment = HEADER_ALIGNMENT
+    header_cell.border = THIN_BORDER
 
     # Process each row
     total_rows = ws.max_row
@@ -150,12 +216,16 @@ def process_excel(input_file="foodraw.xlsx", output_file="foodpreprocessed.xlsx"
 
     print(f"\nProcessing {total_rows - 1} products...")
 
-    for row in range(2, total_rows + 1):
+    # Read the two source columns of every row in one pass
+    source_rows = ws.iter_rows(min_row=2, max_row=total_rows,
+                               max_col=max(allergensraw_col, ingredients_col), values_only=True)
+
+    for row, values in enumerate(source_rows, 2):
         # Get the raw allergens
-        allergensraw = ws.cell(row=row, column=allergensraw_col).value or ""
+        allergensraw = values[allergensraw_col - 1] or ""
 
         # Also check ingredients for allergen mapping (more comprehensive)
-        ingredients = ws.cell(row=row, column=ingredients_col).value or ""
+        ingredients = values[ingredients_col - 1] or ""
 
         # Combine both for mapping
         combined_text = f"{allergensraw} {ingredients}"
@@ -165,7 +235,7 @@ def process_excel(input_file="foodraw.xlsx", output_file="foodpreprocessed.xlsx"
 
         # Write to new column
         cell = ws.cell(row=row, column=new_col, value=mapped)
-        cell.border = thin_border
+        cell.style = "bordered"
 
         if mapped:
             mapped_count += 1
@@ -187,39 +257,51 @@ def create_foodpreprocessed_from_scratch(input_file="foodraw.xlsx", output_file=
     """
     Create a new preprocessed Excel file with all required columns
     """
-    # Load source with data_only=True to get calculated values instead of formulas
-    wb_src = load_workbook(input_file, data_only=True)
+    # Load source with data_only=True to get calculated values instead of formulas;
+    # read_only streams the sheet instead of building the full styled cell model
+    wb_src = load_workbook(input_file, data_only=True, read_only=True)
     ws_src = wb_src.active
 
-    # Create new workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Food Data Preprocessed"
+    # Create new workbook; write-only mode streams rows straight to the output file
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Food Data Preprocessed")
 
     # Define headers for the new file
     headers = ["id", "name", "link", "ingredients", "allergensraw", "allergensmapped"]
 
-    # Style for headers
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Set column widths (write-only sheets need them before the first row)
+    ws.column_dimensions['A'].width = 8  # id
+    ws.column_dimensions['B'].width = 40  # name
+    ws.column_dimensions['C'].width = 55  # link
+    ws.column_dimensions['D'].width = 80  # ingredients
+    ws.column_dimensions['E'].width = 40  # allergensraw
+    ws.column_dimensions['F'].width = 50  # allergensmapped
+
+    # Freeze top row
+    ws.freeze_panes = 'A2'
 
     # Write headers
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = thin_border
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        cell.alignment = WRAPPED_HEADER_ALIGNMENT
+        cell.border = THIN_BORDER
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    # One bordered cell per column, refilled for every row: append() writes the row
+    # out straight away, so the cells and their style are reused rather than rebuilt
+    row_cells = [WriteOnlyCell(ws) for _ in headers]
+    for cell in row_cells:
+        cell.border = THIN_BORDER
+
+    # One pass over the sheet: the header row first, then every data row as a tuple of values
+    src_rows = ws_src.iter_rows(values_only=True)
 
     # Get source headers
-    src_headers = [cell.value for cell in ws_src[1]]
+    src_headers = list(next(src_rows, ()))
     print(f"Source columns: {src_headers}")
 
     # Map source columns
@@ -236,21 +318,35 @@ def create_foodpreprocessed_from_scratch(input_file="foodraw.xlsx", output_file=
     print(f"Reading ingredients from column {ingredients_col}")
     print(f"Reading allergens from column {allergens_col}")
 
-    # Process each row
-    total_rows = ws_src.max_row
+    # Tuple positions of the columns to copy
+    id_idx = col_map.get('id', 1) - 1
+    name_idx = col_map.get('name', 2) - 1
+    link_idx = col_map.get('link', 3) - 1
+    ingredients_idx = ingredients_col - 1
+    allergens_idx = allergens_col - 1
+
+    # Short rows (trailing empty cells) are padded to the columns used
+    width = max(id_idx, name_idx, link_idx, ingredients_idx, allergens_idx) + 1
+
+    # Process each row as it is read, so neither sheet is held in memory
+    total_rows = 1
     mapped_count = 0
 
-    print(f"Processing {total_rows - 1} products...")
+    print("Processing products...")
+
+    for row, values in enumerate(src_rows, 2):
+        if len(values) < width:
+            values += (None,) * (width - len(values))
+        total_rows = row
 
-    for row in range(2, total_rows + 1):
         # Get source values
-        id_val = ws_src.cell(row=row, column=col_map.get('id', 1)).value or ""
-        name_val = ws_src.cell(row=row, column=col_map.get('name', 2)).value or ""
-        link_val = ws_src.cell(row=row, column=col_map.get('link', 3)).value or ""
+        id_val = values[id_idx] or ""
+        name_val = values[name_idx] or ""
+        link_val = values[link_idx] or ""
 
         # Read from raw columns to avoid formula issues
-        ingredients_val = ws_src.cell(row=row, column=ingredients_col).value or ""
-        allergensraw_val = ws_src.cell(row=row, column=allergens_col).value or ""
+        ingredients_val = values[ingredients_idx] or ""
+        allergensraw_val = values[allergens_idx] or ""
 
         # Skip if value looks like a formula (starts with =)
         if str(ingredients_val).startswith("="):
@@ -266,27 +362,16 @@ def create_foodpreprocessed_from_scratch(input_file="foodraw.xlsx", output_file=
             mapped_count += 1
 
         # Write to destination
-        dest_row = row
-        ws.cell(row=dest_row, column=1, value=id_val).border = thin_border
-        ws.cell(row=dest_row, column=2, value=name_val).border = thin_border
-        ws.cell(row=dest_row, column=3, value=link_val).border = thin_border
-        ws.cell(row=dest_row, column=4, value=ingredients_val).border = thin_border
-        ws.cell(row=dest_row, column=5, value=allergensraw_val).border = thin_border
-        ws.cell(row=dest_row, column=6, value=allergensmapped).border = thin_border
+        row_values = (id_val, name_val, link_val, ingredients_val, allergensraw_val, allergensmapped)
+        for cell, value in zip(row_cells, row_values):
+            cell.value = value
+        ws.append(row_cells)
 
         if row % 50 == 0:
-            print(f"  Processed {row - 1}/{total_rows - 1} products...")
+            print(f"  Processed {row - 1} products...")
 
-    # Set column widths
-    ws.column_dimensions['A'].width = 8  # id
-    ws.column_dimensions['B'].width = 40  # name
-    ws.column_dimensions['C'].width = 55  # link
-    ws.column_dimensions['D'].width = 80  # ingredients
-    ws.column_dimensions['E'].width = 40  # allergensraw
-    ws.column_dimensions['F'].width = 50  # allergensmapped
-
-    # Freeze top row
-    ws.freeze_panes = 'A2'
+    wb_src.close()
+    print(f"Processed {total_rows - 1} products")
 
     # Save
     wb.save(output_file)